@@ -1,74 +1,147 @@
+import asyncio
+import hashlib
+import json
+import os
 import pandas as pd
+from typing import List
+from filelock import FileLock
 from langchain_core.documents import Document
 from langchain_chroma import Chroma
 from langchain_core.prompts.chat import ChatPromptTemplate, MessagesPlaceholder
 from langchain_openai import OpenAIEmbeddings,  ChatOpenAI
 from langchain.agents.agent import AgentExecutor
 from langchain.agents.openai_functions_agent.base import create_openai_functions_agent
-from tools.stock import VectorProductStockTool
+from agents.cache import SemanticCache
+from agents.embeddings import ConcurrentOpenAIEmbeddings, embedding_signature
+from tools.stock import VectorProductStockTool, PRODUCT_DEFAULTS
 
 
-def create_product_documents(df: pd.DataFrame):
-    documents = []
-
-    for idx, row in df.iterrows():
-        content_parts = []
-        content_parts.append(f"Name: {row.get('name', 'N/A')}")
-        content_parts.append(f"SKU: {row.get('sku', 'N/A')}")
-        content_parts.append(f"Brand: {row.get('brand', 'N/A')}")
-        content_parts.append(f"Description: {row.get('description', 'N/A')}")
-        content_parts.append(f"Short Description: {row.get('short_description', 'N/A')}")
-        content_parts.append(f"Category ID: {row.get('category_id', 'N/A')}")
-        content_parts.append(f"Quantity: {row.get('quantity', 0)}")
-        content_parts.append(f"Stock Status: {row.get('stock_status', 'unknown')}")
-        content_parts.append(f"Low Stock Threshold: {row.get('low_stock_threshold', 10)}")
-        content_parts.append(f"Price: {row.get('price', 0)}")
-        content_parts.append(f"Cost: {row.get('cost', 0)}")
-        content_parts.append(f"Currency: {row.get('currency', 'USD')}")
-        content_parts.append(f"Material: {row.get('material', 'N/A')}")
-        content_parts.append(f"Model: {row.get('model', 'N/A')}")
-        content_parts.append(f"Colors: {row.get('colors', 'N/A')}")
-        content_parts.append(f"Sizes: {row.get('sizes', 'N/A')}")
-        content_parts.append(f"Weight: {row.get('weight', 'N/A')}")
-        content_parts.append(f"Supplier ID: {row.get('supplier_id', 'N/A')}")
-        content_parts.append(f"Supplier SKU: {row.get('supplier_sku', 'N/A')}")
-        content_parts.append(f"Lead Time: {row.get('lead_time', 'N/A')}")
-        content_parts.append(f"SEO Title: {row.get('seo_title', 'N/A')}")
-        content_parts.append(f"Tags: {row.get('tags', 'N/A')}")
-        content_parts.append(f"Barcode: {row.get('barcode', 'N/A')}")
-
-        content = '\n'.join(content_parts)
-        metadata = {
-            'product_id': row.get('id', idx),
-            'sku': row.get('sku', ''),
-            'name': row.get('name', ''),
-            'brand': row.get('brand', ''),
-            'category_id': row.get('category_id', ''),
-            'stock_status': row.get('stock_status', ''),
-            'quantity': row.get('quantity', 0),
-            'price': row.get('price', 0),
-            'row_index': idx
-        }
-        doc = Document(
-            page_content=content,
-            metadata=metadata
-        )
-        documents.append(doc)
+_VECTORSTORE_DIRECTORY = "./xventory_vectorstore"
+_MANIFEST_PATH = os.path.join(_VECTORSTORE_DIRECTORY, "manifest.json")
+_LOCK_PATH = os.path.join(_VECTORSTORE_DIRECTORY, ".lock")
+_BATCH_CONCURRENCY = 5
+
+_SYSTEM_PROMPT = """You are xventory, an AI assistant specialized in inventory management.
+            Your primary function is to help users check product stock levels and inventory information.
 
+            Key capabilities:
+            - Check stock quantities for products
+            - Identify low stock and out-of-stock items
+            - Provide detailed inventory information
+            - Search products by name, SKU, or description
+
+            Important guidelines:
+            - Focus only on inventory-related queries
+            - Use the check_product_stock tool for all stock-related questions
+            - Provide clear, actionable inventory information
+            - If asked about non-inventory topics, politely redirect to inventory matters
+
+            Always be helpful and provide detailed stock information when available."""
+
+_PROMPT_TEMPLATE = ChatPromptTemplate.from_messages([
+    ("system", _SYSTEM_PROMPT),
+    ("user", "{input}"),
+    MessagesPlaceholder(variable_name="agent_scratchpad"),
+])
+
+_CONTENT_FIELDS = (
+    ("Name", "name", "N/A"),
+    ("SKU", "sku", "N/A"),
+    ("Brand", "brand", "N/A"),
+    ("Description", "description", "N/A"),
+    ("Short Description", "short_description", "N/A"),
+    ("Category ID", "category_id", "N/A"),
+    ("Quantity", "quantity", 0),
+    ("Stock Status", "stock_status", "unknown"),
+    ("Low Stock Threshold", "low_stock_threshold", 10),
+    ("Price", "price", 0),
+    ("Cost", "cost", 0),
+    ("Currency", "currency", "USD"),
+    ("Material", "material", "N/A"),
+    ("Model", "model", "N/A"),
+    ("Colors", "colors", "N/A"),
+    ("Sizes", "sizes", "N/A"),
+    ("Weight", "weight", "N/A"),
+    ("Supplier ID", "supplier_id", "N/A"),
+    ("Supplier SKU", "supplier_sku", "N/A"),
+    ("Lead Time", "lead_time", "N/A"),
+    ("SEO Title", "seo_title", "N/A"),
+    ("Tags", "tags", "N/A"),
+    ("Barcode", "barcode", "N/A"),
+)
+
+
+def create_product_documents(df: pd.DataFrame):
+    content_defaults = {column: default for _, column, default in _CONTENT_FIELDS}
+    # object first so string defaults can fill arrow-typed numeric columns
+    values = df.reindex(columns=list(content_defaults)).astype(object).fillna(content_defaults).astype(str)
+    parts = [f"{label}: " + values[column] for label, column, _ in _CONTENT_FIELDS]
+    contents = parts[0].str.cat(parts[1:], sep="\n")
+
+    metadata = df.reindex(columns=list(PRODUCT_DEFAULTS)).astype(object).fillna(PRODUCT_DEFAULTS)
+    metadata.insert(0, "product_id", df["id"] if "id" in df.columns else df.index)
+    metadata["row_index"] = df.index
+
+    documents = [
+        Document(page_content=content, metadata=meta)
+        for content, meta in zip(contents.tolist(), metadata.to_dict(orient="records"))
+    ]
     return documents
 
+def _document_id(doc: Document) -> str:
+    payload = doc.page_content + json.dumps(doc.metadata, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+def _load_manifest() -> dict:
+    try:
+        with open(_MANIFEST_PATH, encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def _save_manifest(manifest: dict):
+    with open(_MANIFEST_PATH, "w", encoding="utf-8") as f:
+        json.dump(manifest, f)
+
 def setup_vectorstore(
         df: pd.DataFrame,
         embeddings: OpenAIEmbeddings
 ):
     try:
-        documents = create_product_documents(df)
-        vectorstore = Chroma.from_documents(
-            documents=documents,
-            embedding=embeddings,
-            persist_directory="./xventory_vectorstore"
-        )
-        return vectorstore
+        os.makedirs(_VECTORSTORE_DIRECTORY, exist_ok=True)
+        # with several workers only the first one through does the embedding, the rest see a matching manifest
+        with FileLock(_LOCK_PATH):
+            manifest = _load_manifest()
+            vectorstore = Chroma(
+                persist_directory=_VECTORSTORE_DIRECTORY,
+                embedding_function=embeddings
+            )
+            signature = embedding_signature(embeddings)
+            # ids hash the generated documents, so a change to the data or to how documents are
+            # built both show up here, and building them costs nothing next to embedding
+            documents = {_document_id(doc): doc for doc in create_product_documents(df)}
+            if manifest.get("embedding") == signature and set(manifest.get("ids", [])) == documents.keys():
+                return vectorstore
+
+            # vectors from another model or dimension can't be mixed in, and without ids we
+            # can't tell what the collection holds, so start over
+            if "ids" not in manifest or manifest.get("embedding") != signature:
+                vectorstore.reset_collection()
+                manifest = {}
+
+            stored_ids = set(manifest.get("ids", []))
+            stale_ids = list(stored_ids - documents.keys())
+            new_ids = [doc_id for doc_id in documents if doc_id not in stored_ids]
+            # a single upsert over chroma's max batch size is rejected, so write in chunks of it
+            batch_size = vectorstore._client.get_max_batch_size()
+            for i in range(0, len(stale_ids), batch_size):
+                vectorstore.delete(ids=stale_ids[i:i + batch_size])
+            for i in range(0, len(new_ids), batch_size):
+                batch_ids = new_ids[i:i + batch_size]
+                vectorstore.add_documents([documents[doc_id] for doc_id in batch_ids], ids=batch_ids)
+
+            _save_manifest({"embedding": signature, "ids": list(documents)})
+            return vectorstore
     except Exception as e:
         return None
 
@@ -82,34 +155,14 @@ def initialize_agent(api_key):
     return llm
 
 
-def create_agent(api_key, df: pd.DataFrame):
+def create_agent(api_key, df: pd.DataFrame, embeddings: OpenAIEmbeddings = None):
     llm = initialize_agent(api_key)
-    embeddings = OpenAIEmbeddings(api_key=api_key)
+    if embeddings is None:
+        embeddings = ConcurrentOpenAIEmbeddings(api_key=api_key)
     vectorstore = setup_vectorstore(df, embeddings)
     stock_tool = VectorProductStockTool(csv_data=df, vectorstore=vectorstore)
 
-    prompt = ChatPromptTemplate.from_messages([
-        ("system", """You are xventory, an AI assistant specialized in inventory management.
-            Your primary function is to help users check product stock levels and inventory information.
-
-            Key capabilities:
-            - Check stock quantities for products
-            - Identify low stock and out-of-stock items
-            - Provide detailed inventory information
-            - Search products by name, SKU, or description
-
-            Important guidelines:
-            - Focus only on inventory-related queries
-            - Use the check_product_stock tool for all stock-related questions
-            - Provide clear, actionable inventory information
-            - If asked about non-inventory topics, politely redirect to inventory matters
-
-            Always be helpful and provide detailed stock information when available."""),
-        ("user", "{input}"),
-        MessagesPlaceholder(variable_name="agent_scratchpad"),
-    ])
-
-    agent = create_openai_functions_agent(llm, [stock_tool], prompt=prompt)
+    agent = create_openai_functions_agent(llm, [stock_tool], prompt=_PROMPT_TEMPLATE)
     agent_executor = AgentExecutor(
         agent=agent,
         tools=[stock_tool],
@@ -119,9 +172,39 @@ def create_agent(api_key, df: pd.DataFrame):
     return agent_executor
 
 
-def run_query(agent_executor, query):
-    try:
+def run_query(agent_executor, query, cache: SemanticCache = None):
+    def _invoke():
         response = agent_executor.invoke({"input": query})
         return response.get("output", "No response from agent.")
+
+    try:
+        if cache is None:
+            return _invoke()
+        return cache.get_or_compute(query, _invoke)
+    except Exception as e:
+        return f"Error during agent execution: {str(e)}"
+
+
+async def arun_query(agent_executor, query, cache: SemanticCache = None):
+    async def _ainvoke():
+        response = await agent_executor.ainvoke({"input": query})
+        return response.get("output", "No response from agent.")
+
+    try:
+        if cache is None:
+            return await _ainvoke()
+        return await cache.aget_or_compute(query, _ainvoke)
     except Exception as e:
-        return f"Error during agent execution: {str(e)}"
\ No newline at end of file
+        return f"Error during agent execution: {str(e)}"
+
+
+async def run_query_batch(agent_executor, queries: List[str], cache: SemanticCache = None) -> List[str]:
+    # the agent round-trips are network bound, so run them side by side instead of back to back,
+    # a few at a time to stay inside the OpenAI rate limits
+    semaphore = asyncio.Semaphore(_BATCH_CONCURRENCY)
+
+    async def _run(query):
+        async with semaphore:
+            return await arun_query(agent_executor, query, cache)
+
+    return list(await asyncio.gather(*[_run(query) for query in queries]))
\ No newline at end of file
@@ -0,0 +1,117 @@
+import asyncio
+import hashlib
+import threading
+import time
+from typing import Awaitable, Callable, List, Optional
+from cachetools import TTLCache
+from langchain_chroma import Chroma
+from langchain_openai import OpenAIEmbeddings
+from agents.embeddings import embedding_signature
+from tools.stock import is_sku_like
+
+_SEMCACHE_DIRECTORY = "./xventory_semcache"
+_SEMCACHE_COLLECTION = "xventory_semcache"
+_HOT_CACHE_SIZE = 4096
+
+
+def _exact_key(query: str) -> bytes:
+    normalized = " ".join(query.lower().split())
+    return hashlib.blake2b(normalized.encode("utf-8"), digest_size=16).digest()
+
+
+def _names_product(query: str) -> bool:
+    # "stock of F683CCE6" and "stock of 7F7F840B" embed almost identically but ask about different
+    # products, so queries carrying an identifier only ever match exactly
+    return any(is_sku_like(token) for token in query.split())
+
+
+class SemanticCache:
+    def __init__(
+            self,
+            embeddings: OpenAIEmbeddings,
+            threshold: float = 0.92,
+            ttl: float = 3600
+    ):
+        self.threshold = threshold
+        self.ttl = ttl
+        self._embeddings = embeddings
+        # exact-match LRU tier keyed by the normalized query, consulted before embedding anything
+        self._hot = TTLCache(maxsize=_HOT_CACHE_SIZE, ttl=ttl)
+        self._hot_lock = threading.Lock()
+        self._store = Chroma(
+            # one collection per embedding model so vectors of different sizes never meet
+            collection_name=f"{_SEMCACHE_COLLECTION}_{embedding_signature(embeddings)}",
+            embedding_function=embeddings,
+            persist_directory=_SEMCACHE_DIRECTORY,
+            collection_metadata={"hnsw:space": "cosine"}
+        )
+
+    def get_or_compute(self, query: str, compute: Callable[[], str]) -> str:
+        key = _exact_key(query)
+        with self._hot_lock:
+            output = self._hot.get(key)
+        if output is not None:
+            return output
+
+        if _names_product(query):
+            output = compute()
+        else:
+            embedding = self._embeddings.embed_query(query)
+            output = self._nearest(embedding)
+            if output is None:
+                output = compute()
+                self._add(query, embedding, output)
+
+        with self._hot_lock:
+            self._hot[key] = output
+        return output
+
+    async def aget_or_compute(self, query: str, compute: Callable[[], Awaitable[str]]) -> str:
+        key = _exact_key(query)
+        with self._hot_lock:
+            output = self._hot.get(key)
+        if output is not None:
+            return output
+
+        if _names_product(query):
+            output = await compute()
+        else:
+            embedding = await self._embeddings.aembed_query(query)
+            output = await asyncio.to_thread(self._nearest, embedding)
+            if output is None:
+                output = await compute()
+                await asyncio.to_thread(self._add, query, embedding, output)
+
+        with self._hot_lock:
+            self._hot[key] = output
+        return output
+
+    def invalidate(self):
+        with self._hot_lock:
+            self._hot.clear()
+        self._store.reset_collection()
+
+    def _nearest(self, embedding: List[float]) -> Optional[str]:
+        res = self._store.similarity_search_by_vector_with_relevance_scores(embedding, k=1)
+        if not res:
+            return None
+
+        doc, distance = res[0]
+        # cosine space: chroma reports distance, similarity is its complement
+        if 1 - distance < self.threshold:
+            return None
+
+        if time.time() - doc.metadata.get("created_at", 0) > self.ttl:
+            if doc.id:
+                self._store.delete(ids=[doc.id])
+            return None
+
+        return doc.metadata.get("output")
+
+    def _add(self, query: str, embedding: List[float], output: str):
+        self._store._collection.upsert(
+            ids=[hashlib.sha256(query.encode("utf-8")).hexdigest()],
+            embeddings=[embedding],
+            documents=[query],
+            metadatas=[{"output": output, "created_at": time.time()}]
+        )
@@ -0,0 +1,62 @@
+import asyncio
+import time
+from typing import Any, List, Optional
+from openai import RateLimitError
+from langchain_openai import OpenAIEmbeddings
+
+_MAX_RETRIES = 5
+
+
+def embedding_signature(embeddings: OpenAIEmbeddings) -> str:
+    return f"{embeddings.model}-{embeddings.dimensions or 'full'}"
+
+
+class ConcurrentOpenAIEmbeddings(OpenAIEmbeddings):
+    # shortened text-embedding-3 vectors: 512 dims instead of ada-002's 1536, a third of the index memory
+    model: str = "text-embedding-3-small"
+    dimensions: Optional[int] = 512
+    max_concurrency: int = 8
+    # product documents sit far below the context limit, so skip the tiktoken split and let
+    # batches go out side by side
+    check_embedding_ctx_length: bool = False
+
+    def embed_documents(self, texts: List[str], chunk_size: Optional[int] = None, **kwargs: Any) -> List[List[float]]:
+        chunk_size = chunk_size or self.chunk_size
+        # a single request has nothing to overlap, and the ctx-length path splits long texts itself
+        if len(texts) <= chunk_size or self.check_embedding_ctx_length:
+            return super().embed_documents(texts, chunk_size, **kwargs)
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            pass
+        else:
+            # asyncio.run can't nest inside a running loop, keep the stock behaviour there
+            return super().embed_documents(texts, chunk_size, **kwargs)
+
+        try:
+            return asyncio.run(self._embed_batches(texts, chunk_size, **kwargs))
+        except RateLimitError:
+            return self._embed_sequential(texts, chunk_size, **kwargs)
+
+    async def _embed_batches(self, texts: List[str], chunk_size: int, **kwargs: Any) -> List[List[float]]:
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+        client_kwargs = {**self._invocation_params, **kwargs}
+
+        async def _embed(batch: List[str]) -> List[List[float]]:
+            async with semaphore:
+                # the sync client is thread-safe and, unlike the async one, not bound to a loop
+                response = await asyncio.to_thread(self.client.create, input=batch, **client_kwargs)
+            return [item.embedding for item in response.data]
+
+        batches = [texts[i:i + chunk_size] for i in range(0, len(texts), chunk_size)]
+        results = await asyncio.gather(*[_embed(batch) for batch in batches])
+        return [embedding for batch in results for embedding in batch]
+
+    def _embed_sequential(self, texts: List[str], chunk_size: int, **kwargs: Any) -> List[List[float]]:
+        for attempt in range(_MAX_RETRIES):
+            try:
+                return super().embed_documents(texts, chunk_size, **kwargs)
+            except RateLimitError:
+                if attempt == _MAX_RETRIES - 1:
+                    raise
+                time.sleep(2 ** attempt)
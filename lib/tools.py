@@ -1,6 +1,7 @@
 from typing import List
 from langchain_core.documents import Document
 from langchain_community.document_loaders.csv_loader import CSVLoader
+import numpy as np
 import pandas as pd
 
 def load_data(file_path: str) -> List[Document]:
@@ -15,10 +16,28 @@ def load_data(file_path: str) -> List[Document]:
     data = loader.load()
     return data
 
+_INT_COLUMNS = ("quantity", "low_stock_threshold", "lead_time", "category_id")
+_FLOAT_COLUMNS = ("price", "cost", "compare_at_price", "weight")
+
 def load_csv_as_dataframe(file_path: str) -> pd.DataFrame:
     try:
-        df = pd.read_csv(file_path, encoding="utf-8")
-        return df
-    except Exception as e:
+        df = pd.read_csv(
+            file_path,
+            encoding="utf-8",
+            engine="pyarrow",
+            dtype_backend="pyarrow"
+        )
+    except (FileNotFoundError, pd.errors.ParserError) as e:
         return pd.DataFrame()
 
+    # typed once here so document text and metadata carry real numbers and nothing downstream re-parses them
+    for col in _INT_COLUMNS + _FLOAT_COLUMNS:
+        if col in df.columns:
+            # through numpy floats: arrow keeps a coerced NaN apart from NA, which fillna would miss
+            values = pd.to_numeric(df[col], errors="coerce").astype("float64").fillna(0)
+            if col in _INT_COLUMNS:
+                # truncate like int(float(v)) did, arrow refuses to cast 3.5 to an int
+                df[col] = np.trunc(values).astype("int64[pyarrow]")
+            else:
+                df[col] = values.astype("float64[pyarrow]")
+    return df
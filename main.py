@@ -1,9 +1,13 @@
+import asyncio
 import os
+from contextlib import asynccontextmanager
 from typing import Union
 from fastapi import FastAPI
 from dotenv import load_dotenv
-from models.query import QueryRequest
-from agents.agent import create_agent, run_query
+from models.query import QueryRequest, BatchQueryRequest
+from agents.agent import create_agent, arun_query, run_query_batch
+from agents.cache import SemanticCache
+from agents.embeddings import ConcurrentOpenAIEmbeddings
 from lib.tools import load_csv_as_dataframe
 
 load_dotenv()
@@ -11,14 +15,30 @@ load_dotenv()
 OPEN_AI_MODEL = os.getenv("OPENAI_MODEL", "gpt-3.5-turbo")
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 file_path = os.getenv("FILE_PATH")
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.92"))
+SEMANTIC_CACHE_TTL = float(os.getenv("SEMANTIC_CACHE_TTL", "3600"))
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    df = load_csv_as_dataframe(file_path)
+    embeddings = ConcurrentOpenAIEmbeddings(api_key=OPENAI_API_KEY)
+    # off the event loop so document embedding can run its own concurrent batches
+    app.state.agent = await asyncio.to_thread(create_agent, OPENAI_API_KEY, df, embeddings)
+    app.state.cache = SemanticCache(
+        embeddings,
+        threshold=SEMANTIC_CACHE_THRESHOLD,
+        ttl=SEMANTIC_CACHE_TTL
+    )
+    yield
+
 
 app = FastAPI(
         title="xventory AI Agent",
         description="An AI agent for inventory management",
-        version="1.0.0"
+        version="1.0.0",
+        lifespan=lifespan
     )
-df = load_csv_as_dataframe(file_path)
-agent = create_agent(OPENAI_API_KEY, df)
 
 @app.get("/api/v1/health-check")
 async def health_check() -> Union[str, dict]:
@@ -32,9 +52,29 @@ async def health_check() -> Union[str, dict]:
 async def run_agent(request: QueryRequest) -> Union[str, dict]:
 
     try:
-        result = run_query(agent, request.query)
+        result = await arun_query(app.state.agent, request.query, app.state.cache)
         return {"response": result}
     except Exception as e:
         return {"error": str(e)}
 
 
+@app.post("/api/v1/cache/clear")
+async def clear_cache() -> Union[str, dict]:
+    try:
+        app.state.cache.invalidate()
+        for tool in app.state.agent.tools:
+            if hasattr(tool, "clear_cache"):
+                tool.clear_cache()
+        return {"response": "Cache cleared"}
+    except Exception as e:
+        return {"error": str(e)}
+
+
+@app.post("/api/v1/ask-agent/batch")
+async def run_agent_batch(request: BatchQueryRequest) -> Union[str, dict]:
+
+    try:
+        results = await run_query_batch(app.state.agent, request.queries, app.state.cache)
+        return {"responses": results}
+    except Exception as e:
+        return {"error": str(e)}
@@ -1,4 +1,8 @@
+from typing import List
 from pydantic import BaseModel
 
 class QueryRequest(BaseModel):
-    query: str
\ No newline at end of file
+    query: str
+
+class BatchQueryRequest(BaseModel):
+    queries: List[str]
\ No newline at end of file
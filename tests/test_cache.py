@@ -0,0 +1,25 @@
+from tools.cache import QueryCache
+
+
+def test_get_similar_returns_closest_live_entry():
+    cache = QueryCache(max_size=2, threshold=0.9)
+    cache.put("red shoe", "shoes", [1.0, 0.0])
+    cache.put("blue hat", "hats", [0.0, 1.0])
+
+    assert cache.get_similar([0.99, 0.05]) == "shoes"
+    assert cache.get_similar([0.7, 0.7]) is None
+
+
+def test_get_similar_skips_overwritten_and_evicted_rows():
+    cache = QueryCache(max_size=2, threshold=0.9)
+    cache.put("red shoe", "shoes", [1.0, 0.0])
+    # same key again with another embedding: the old row must no longer answer for it
+    cache.put("red shoe", "boots", [0.0, 1.0])
+    assert cache.get_similar([1.0, 0.0]) is None
+    assert cache.get_similar([0.0, 1.0]) == "boots"
+
+    cache.put("green bag", "bags", [0.6, 0.8])
+    cache.put("black cap", "caps", [0.8, -0.6])
+    assert cache.get("red shoe") is None
+    assert cache.get_similar([0.0, 1.0]) is None
+    assert cache.get_similar([0.6, 0.8]) == "bags"
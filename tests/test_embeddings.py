@@ -0,0 +1,23 @@
+from types import SimpleNamespace
+from agents.embeddings import ConcurrentOpenAIEmbeddings
+
+
+class _StubClient:
+    def __init__(self):
+        self.batches = []
+
+    def create(self, input, **kwargs):
+        self.batches.append(list(input))
+        return SimpleNamespace(data=[SimpleNamespace(embedding=[float(len(text))]) for text in input])
+
+
+def test_embed_documents_sends_batches_concurrently():
+    embeddings = ConcurrentOpenAIEmbeddings(api_key="test", chunk_size=2)
+    client = _StubClient()
+    object.__setattr__(embeddings, "client", client)
+
+    texts = ["a", "bb", "ccc", "dddd", "eeeee"]
+    result = embeddings.embed_documents(texts)
+
+    assert result == [[1.0], [2.0], [3.0], [4.0], [5.0]]
+    assert sorted(client.batches) == [["a", "bb"], ["ccc", "dddd"], ["eeeee"]]
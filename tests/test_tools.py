@@ -0,0 +1,19 @@
+from lib.tools import load_csv_as_dataframe
+
+
+def test_load_csv_truncates_fractional_int_columns(tmp_path):
+    path = tmp_path / "products.csv"
+    path.write_text(
+        "sku,quantity,lead_time,price\n"
+        "A1,3.5,-2.7,12.5\n"
+        "B2,n/a,,bad\n"
+        "C3,4,2,1\n",
+        encoding="utf-8"
+    )
+
+    df = load_csv_as_dataframe(str(path))
+
+    assert str(df["quantity"].dtype) == "int64[pyarrow]"
+    assert df["quantity"].tolist() == [3, 0, 4]
+    assert df["lead_time"].tolist() == [-2, 0, 2]
+    assert df["price"].tolist() == [12.5, 0.0, 1.0]
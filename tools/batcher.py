@@ -0,0 +1,85 @@
+import asyncio
+from typing import List, Tuple
+from langchain_chroma import Chroma
+from langchain_core.documents import Document
+from tools.cache import QueryCache
+
+
+class SimilarityBatcher:
+    def __init__(
+            self,
+            vectorstore: Chroma,
+            cache: QueryCache,
+            k: int = 4,
+            max_batch: int = 32,
+            window: float = 0.005
+    ):
+        self.k = k
+        self.max_batch = max_batch
+        self.window = window
+        self._vectorstore = vectorstore
+        self._cache = cache
+        self._loop = None
+        self._queue = None
+        self._tasks = set()
+
+    async def submit(self, query: str) -> Tuple[List[Document], List[float]]:
+        loop = asyncio.get_running_loop()
+        # queues and futures belong to one loop, start over if we're called from another
+        if self._loop is not loop:
+            self._loop = loop
+            self._queue = asyncio.Queue()
+            self._spawn(self._drain())
+
+        future = loop.create_future()
+        await self._queue.put((query, future))
+        return await future
+
+    def _spawn(self, coro):
+        task = asyncio.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _drain(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.window
+            while len(batch) < self.max_batch:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            self._spawn(self._process(batch))
+
+    async def _process(self, batch: List[Tuple[str, asyncio.Future]]):
+        try:
+            embeddings = await self._vectorstore.embeddings.aembed_documents([query for query, _ in batch])
+
+            pending = []
+            for (_, future), embedding in zip(batch, embeddings):
+                docs = self._cache.get_similar(embedding)
+                if docs is not None:
+                    future.set_result((docs, embedding))
+                else:
+                    pending.append((future, embedding))
+
+            if pending:
+                res = await asyncio.to_thread(
+                    self._vectorstore._collection.query,
+                    query_embeddings=[embedding for _, embedding in pending],
+                    n_results=self.k
+                )
+                for i, (future, embedding) in enumerate(pending):
+                    docs = [
+                        Document(page_content=text, metadata=metadata or {}, id=doc_id)
+                        for text, metadata, doc_id in zip(res["documents"][i], res["metadatas"][i], res["ids"][i])
+                    ]
+                    future.set_result((docs, embedding))
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
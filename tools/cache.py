@@ -0,0 +1,60 @@
+import threading
+from typing import Any, List, Optional
+import numpy as np
+from cachetools import TTLCache
+
+
+def _unit(embedding: List[float]) -> np.ndarray:
+    vec = np.asarray(embedding, dtype=np.float32)
+    norm = np.linalg.norm(vec)
+    return vec / norm if norm else vec
+
+
+class QueryCache:
+    def __init__(self, max_size: int = 2000, ttl: float = 300, threshold: float = 0.95):
+        self.threshold = threshold
+        # LRU with per-entry expiry, values are (result, row of its embedding in _vectors)
+        self._entries = TTLCache(maxsize=max_size, ttl=ttl)
+        # unit query embeddings in a ring written by put, a lookup is one matvec with nothing copied
+        self._vectors = None
+        self._keys = [None] * max_size
+        self._next = 0
+        self._lock = threading.RLock()
+
+    def get(self, key: str) -> Optional[Any]:
+        with self._lock:
+            entry = self._entries.get(key)
+        return entry[0] if entry else None
+
+    def get_similar(self, embedding: List[float]) -> Optional[Any]:
+        with self._lock:
+            if self._vectors is None:
+                return None
+
+            sims = self._vectors @ _unit(embedding)
+            candidates = np.flatnonzero(sims >= self.threshold)
+            # best first, skipping rows whose entry expired, was evicted or was put again since
+            for slot in candidates[np.argsort(sims[candidates])[::-1]]:
+                entry = self._entries.get(self._keys[slot])
+                if entry is not None and entry[1] == slot:
+                    return entry[0]
+        return None
+
+    def put(self, key: str, value: Any, embedding: List[float]):
+        vec = _unit(embedding)
+        with self._lock:
+            if self._vectors is None or self._vectors.shape[1] != len(vec):
+                self._vectors = np.zeros((len(self._keys), len(vec)), dtype=np.float32)
+                self._keys = [None] * len(self._keys)
+            slot = self._next
+            self._next = (slot + 1) % len(self._keys)
+            self._vectors[slot] = vec
+            self._keys[slot] = key
+            self._entries[key] = (value, slot)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._vectors = None
+            self._keys = [None] * len(self._keys)
+            self._next = 0
@@ -1,13 +1,91 @@
+import asyncio
+import re
+import textwrap
+import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+from collections import Counter, defaultdict
 from typing import List, Dict
 from langchain_core.tools import BaseTool
 from langchain_chroma import Chroma
 from langchain_core.documents import Document
 from pydantic import BaseModel, Field
 from rapidfuzz import process, fuzz
+from rank_bm25 import BM25Okapi
+from tools.batcher import SimilarityBatcher
+from tools.cache import QueryCache
 
 _SIM_THRESHOLD = 0.22
 _FUZZ_THRESHOLD = 70
+_QUERY_SIM_THRESHOLD = 0.95
+_SEMANTIC_K = 10
+_BM25_THRESHOLD = 5.0
+_SEARCH_COLUMNS = ('name', 'sku', 'brand', 'description', 'short_description')
+_TOKEN_RE = re.compile(r"\w+")
+_PREFIX_LENGTHS = range(3, 6)
+_PREFIX_CACHE_SIZE = 512
+# everything _format_stock_results reads; documents carrying all of it in metadata aren't parsed
+_PRODUCT_FIELDS = frozenset({
+    'name', 'sku', 'brand', 'quantity', 'stock_status', 'low_stock_threshold',
+    'price', 'supplier_sku', 'lead_time', 'short_description',
+})
+# metadata fields every product document carries, with the value an empty cell gets
+PRODUCT_DEFAULTS = {
+    "sku": "",
+    "name": "",
+    "brand": "",
+    "category_id": "",
+    "stock_status": "",
+    "quantity": 0,
+    "low_stock_threshold": 10,
+    "price": 0,
+    "currency": "USD",
+    "short_description": "",
+    "supplier_sku": "",
+    "lead_time": 0,
+}
+# columns a bm25/fuzzy hit is rebuilt from: _PRODUCT_FIELDS plus description and currency
+_ROW_FIELDS = (
+    'name', 'sku', 'brand', 'description', 'short_description', 'quantity', 'stock_status',
+    'low_stock_threshold', 'price', 'currency', 'supplier_sku', 'lead_time',
+)
+_LINE_RE = re.compile(r'^([^:\n]+):[ \t]*(.*)$', re.M)
+_KEY_TRANS = str.maketrans(' ', '_')
+_INT_KEYS = frozenset({'quantity', 'low_stock_threshold', 'lead_time', 'category_id'})
+_FLOAT_KEYS = frozenset({'price', 'cost', 'compare_at_price', 'weight'})
+_NAN = frozenset({'', 'nan', 'n/a'})
+_HEADER_RULE = "=" * 50 + "\n\n"
+_PRODUCT_RULE = "\n" + "-" * 30 + "\n\n"
+
+
+def is_sku_like(query: str) -> bool:
+    # one whitespace-free token with a digit in it reads as a code, not a plain-language question
+    return bool(query) and not any(c.isspace() for c in query) and any(c.isdigit() for c in query)
+
+def _parse_int(value: str) -> int:
+    if value.lower() in _NAN:
+        return 0
+    try:
+        return int(float(value))
+    except (ValueError, OverflowError):
+        return 0
+
+def _parse_float(value: str) -> float:
+    if value.lower() in _NAN:
+        return 0.0
+    try:
+        return float(value)
+    except ValueError:
+        return 0.0
+
+def _parse_text(value: str) -> str:
+    return '' if value.lower() in _NAN else value
+
+_CONVERTERS = {
+    **{key: _parse_int for key in _INT_KEYS},
+    **{key: _parse_float for key in _FLOAT_KEYS},
+}
 
 
 class StockCheckInput(BaseModel):
@@ -15,7 +93,7 @@ class StockCheckInput(BaseModel):
 
 class VectorProductStockTool(BaseTool):
     name: str = "check_product_stock"
-    description: str = """
+    description: str = textwrap.dedent("""
         Check product stock levels in inventory. 
         Use this tool to:
         - Check stock quantity for specific products by name or SKU
@@ -24,7 +102,7 @@ class VectorProductStockTool(BaseTool):
         - Get inventory details for products
 
         Input should be a product name, SKU, or search query.
-    """
+    """)
     args_schema: type = StockCheckInput
     vectorstore: Chroma = Field(default=None)
     csv_data: pd.DataFrame = Field(default_factory=pd.DataFrame)
@@ -35,201 +113,301 @@ class VectorProductStockTool(BaseTool):
     def __init__(self, vectorstore: Chroma, csv_data: pd.DataFrame):
         super().__init__(vectorstore=vectorstore, csv_data=csv_data)
 
-        self._name_index = self.csv_data["name"].fillna("").tolist()
-        self._sku_index = self.csv_data["sku"].fillna("").tolist()
-        self._desc_index = self.csv_data["description"].fillna("").tolist()
-
-
-    def __call__(self, query: str) -> str:
-        docs = self._semantic_lookup(query)
-        if not docs:
-            docs = self._fuzzy_lookup(query)
-
-        if not docs:
-            return f"No products found matching '{query}'. Please check the product name or SKU."
-
-        best = docs[0]
-        m = best.metadata
-        low = m["quantity"] <= m.get("low_stock_threshold", 10)
-
-        answer = (
-            f"**{m['name']}**\n"
-            f"SKU `{m['sku']}` • Qty: **{m['quantity']}** "
-            f"({'LOW STOCK ⚠️' if low else 'in stock'})\n"
-            f"Price: {m['price']} {m.get('currency', 'USD')}"
+        self._name_index = tuple(self.csv_data["name"].fillna("").tolist())
+        self._sku_index = tuple(self.csv_data["sku"].fillna("").tolist())
+        self._desc_index = tuple(self.csv_data["description"].fillna("").tolist())
+        # lowercased once so rapidfuzz can skip its own preprocessing on every query, laid out
+        # name, sku, description back to back with a parallel position -> row map
+        self._all_choices = tuple(str(s).lower() for s in self._name_index + self._sku_index + self._desc_index)
+        self._choice_row_idx = np.tile(np.arange(len(self.csv_data)), 3)
+        self._sku_rows = {}
+        for row, sku in enumerate(self._sku_index):
+            if sku:
+                self._sku_rows.setdefault(str(sku).lower(), row)
+        n = len(self.csv_data)
+        # short sku codes don't need WRatio's partial/token passes, plain ratio is enough there
+        self._fuzzy_channels = (
+            (self._all_choices[:n], fuzz.WRatio),
+            (self._all_choices[n:2 * n], fuzz.ratio),
         )
-        return answer
+        self._fuzzy_descs = self._all_choices[2 * n:]
+        # column-wise python lists so a hit is a handful of list lookups, not a pandas row, with
+        # empty cells filled like the vectorstore documents so arrow NAs never reach formatting
+        row_fields = [c for c in _ROW_FIELDS if c in self.csv_data.columns]
+        rows = self.csv_data[row_fields].astype(object).fillna({**PRODUCT_DEFAULTS, 'description': ''})
+        self._cols = {c: rows[c].tolist() for c in row_fields}
+        corpus = [_TOKEN_RE.findall(choice) for choice in self._all_choices]
+        self._bm25 = BM25Okapi(corpus) if corpus else None
+
+        # only _search_products reads the column index, so it is built on that first call
+        self._search_index = None
+
+        self._prefixes = self._common_prefixes()
+        self._prefix_embeddings = {}
+        self._query_cache = QueryCache(max_size=2000, ttl=300, threshold=_QUERY_SIM_THRESHOLD)
+        self._batcher = SimilarityBatcher(self.vectorstore, self._query_cache, k=_SEMANTIC_K)
+
+    def clear_cache(self):
+        self._query_cache.clear()
+
+    def _common_prefixes(self) -> frozenset:
+        # search-as-you-type sends short sku/name prefixes over and over, their embeddings are kept
+        # for the process once first seen instead of expiring with the query cache
+        counts = Counter()
+        for value in self._name_index + self._sku_index:
+            for token in _TOKEN_RE.findall(str(value).lower()):
+                counts.update({token[:n] for n in _PREFIX_LENGTHS if len(token) >= n})
+
+        return frozenset(prefix for prefix, _ in counts.most_common(_PREFIX_CACHE_SIZE))
+
+    def _semantic_lookup(self, query: str, k: int = _SEMANTIC_K):
+        key = query.strip().lower()
+        docs = self._query_cache.get(key)
+        if docs is not None:
+            return docs
+
+        embedding = self._prefix_embeddings.get(key)
+        if embedding is None:
+            embedding = self.vectorstore.embeddings.embed_query(query)
+            if key in self._prefixes:
+                self._prefix_embeddings[key] = embedding
+
+        # a near-identical earlier query can reuse its results and skip the HNSW search
+        docs = self._query_cache.get_similar(embedding)
+        if docs is None:
+            res = self.vectorstore.similarity_search_by_vector_with_relevance_scores(embedding, k=k)
+            docs = [doc for doc, score in res]
+
+        self._query_cache.put(key, docs, embedding)
+        return docs
+
+    async def _asemantic_lookup(self, query: str):
+        key = query.strip().lower()
+        docs = self._query_cache.get(key)
+        if docs is not None:
+            return docs
+        if key in self._prefix_embeddings:
+            return await asyncio.to_thread(self._semantic_lookup, query)
+
+        # concurrent tool calls share one embedding request and one chroma query
+        docs, embedding = await self._batcher.submit(query)
+        if key in self._prefixes:
+            self._prefix_embeddings[key] = embedding
+        self._query_cache.put(key, docs, embedding)
+        return docs
+
+    def _lexical_lookup(self, query: str):
+        # an exact sku names one product; other code-like tokens skip the embedding round-trip
+        # only when bm25 is confident, everything else is left to semantic search
+        row = self._sku_rows.get(query)
+        if row is not None:
+            return [self._row_document(row)]
+        if is_sku_like(query):
+            return self._bm25_lookup(query) or None
+        return None
+
+    def _bm25_lookup(self, query: str):
+        tokens = _TOKEN_RE.findall(query.lower())
+        if self._bm25 is None or not tokens:
+            return []
 
+        scores = self._bm25.get_scores(tokens)
+        best = int(np.argmax(scores))
+        if scores[best] < _BM25_THRESHOLD:
+            return []
+
+        return [self._row_document(int(self._choice_row_idx[best]))]
 
-    def _semantic_lookup(self, query: str):
-        res = self.vectorstore.similarity_search_with_score(
-            query,
-            k=4
+    def _row_document(self, row: int) -> Document:
+        metadata = {c: values[row] for c, values in self._cols.items()}
+        return Document(
+            page_content=str(metadata.get("description", "")),
+            metadata=metadata
         )
-        return [doc for doc, score in res]
 
     def _fuzzy_lookup(self, query: str):
-        best_hit = None
-        best_score = 0
+        query = query.lower()
+        best_score = _FUZZ_THRESHOLD
         best_row = None
 
-        def _check(choices):
-            nonlocal best_hit, best_score, best_row
-            hit, score, idx = process.extractOne(query, choices, scorer=fuzz.WRatio)
-            if score > best_score:
-                best_score, best_hit, best_row = score, hit, idx
-
-        _check(self._name_index)
-        _check(self._sku_index)
-        _check(self._desc_index)
-
-        if best_score < _FUZZ_THRESHOLD:
+        # the cutoff rises with the best score so far, so each later channel prunes harder
+        for choices, scorer in self._fuzzy_channels:
+            match = process.extractOne(
+                query,
+                choices,
+                scorer=scorer,
+                processor=None,
+                score_cutoff=best_score
+            )
+            if match and (best_row is None or match[1] > best_score):
+                _, best_score, best_row = match
+
+        if best_row is None:
+            # a long description partially matches almost any word, so it only answers when name and sku miss
+            match = process.extractOne(
+                query,
+                self._fuzzy_descs,
+                scorer=fuzz.WRatio,
+                processor=None,
+                score_cutoff=_FUZZ_THRESHOLD
+            )
+            if match:
+                best_row = match[2]
+
+        if best_row is None:
             return []
 
-        row = self.df.iloc[best_row]
-        doc = Document(
-            page_content=str(row.get("description", "")),
-            metadata=row.to_dict()
-        )
-        return [doc]
+        return [self._row_document(best_row)]
 
     def _run(self, query: str) -> str:
         try:
             query = query.strip().lower()
-            #relevant_docs = self._vector_search(query)
-            relevant_docs = self._semantic_lookup(query)
-            if not relevant_docs:
-                relevant_docs = self._fuzzy_lookup(query)
-
-            if not relevant_docs:
-                return f"No products found matching '{query}'. Please check the product name or SKU."
-
-            products_info = self._extract_product_info(relevant_docs)
-            return self._format_stock_results(products_info, query)
+            relevant_docs = self._lexical_lookup(query)
+            if relevant_docs is None:
+                relevant_docs = self._semantic_lookup(query)
+            return self._respond(query, relevant_docs)
         except Exception as e:
             return f"Error checking stock: {str(e)}"
 
-    def _vector_search(self, query: str, k:int=10) -> List[Document]:
+    async def _arun(self, query: str) -> str:
         try:
-            results = self.vectorstore.similarity_search(query, k=k)
-            return results
+            query = query.strip().lower()
+            relevant_docs = self._lexical_lookup(query)
+            if relevant_docs is None:
+                relevant_docs = await self._asemantic_lookup(query)
+            return self._respond(query, relevant_docs)
         except Exception as e:
-            return [Document(page_content=f"Error during vector search: {str(e)}")]
+            return f"Error checking stock: {str(e)}"
+
+    def _respond(self, query: str, relevant_docs: List[Document]) -> str:
+        if not relevant_docs:
+            relevant_docs = self._fuzzy_lookup(query)
+
+        if not relevant_docs:
+            return f"No products found matching '{query}'. Please check the product name or SKU."
+
+        products_info = self._extract_product_info(relevant_docs)
+        return self._format_stock_results(products_info, query)
 
     def _extract_product_info(self, docs: List[Document]) -> List[Dict]:
-        products = []
-        seen_skus = set()
+        # keyed by sku: insertion order keeps the ranking, first hit per sku wins
+        products = {}
+        parse = self._parse_product_content
+        add = products.setdefault
 
         for doc in docs:
-            try:
-                metadata = doc.metadata
-                content = doc.page_content
-                product_data = self._parse_product_content(content, metadata)
-                if product_data and product_data.get("sku") not in seen_skus:
-                    seen_skus.add(product_data.get("sku"))
-                    products.append(product_data)
-            except Exception as e:
+            metadata = doc.metadata
+            if metadata and "sku" in metadata and metadata["sku"] in products:
                 continue
+            product_data = parse(doc.page_content, metadata)
+            if product_data:
+                add(product_data.get("sku"), product_data)
 
-        return products
+        return list(products.values())
 
     def _parse_product_content(self, content: str, metadata: Dict) -> Dict:
-        try:
-            lines = content.strip().split('\n')
-            product_data = {}
-
-            for line in lines:
-                if ':' in line:
-                    key, value = line.split(':', 1)
-                    key = key.strip().lower().replace(' ', '_')
-                    value = value.strip()
-
-                    if key in ['quantity', 'low_stock_threshold', 'lead_time', 'category_id']:
-                        try:
-                            product_data[key] = int(
-                                float(value)) if value and value.lower() not in ['nan',
-                                                                                 'n/a'] else 0
-                        except:
-                            product_data[key] = 0
-                    elif key in ['price', 'cost', 'compare_at_price', 'weight']:
-                        try:
-                            product_data[key] = float(value) if value and value.lower() not in [
-                                'nan', 'n/a'] else 0.0
-                        except:
-                            product_data[key] = 0.0
-                    else:
-                        product_data[key] = value if value.lower() not in ['nan', 'n/a'] else ''
-
-            if metadata:
-                product_data.update(metadata)
-
-            return product_data
+        # ingestion stores every field we format in metadata, the text is only parsed for documents without it
+        if metadata and _PRODUCT_FIELDS <= metadata.keys():
+            return dict(metadata)
 
-        except Exception as e:
-            return {}
+        product_data = {}
+        for match in _LINE_RE.finditer(content):
+            key = match.group(1).strip().lower().translate(_KEY_TRANS)
+            product_data[key] = _CONVERTERS.get(key, _parse_text)(match.group(2).strip())
 
+        if metadata:
+            product_data.update(metadata)
+
+        return product_data
 
-    def _search_products(self, query: str) -> pd.DataFrame:
-        df = self.data.copy()
-        search_columns = ['name', 'sku', 'brand', 'description', 'short_description']
-        mask = pd.Series([False] * len(df))
 
-        for col in search_columns:
-            if col in df.columns:
-                df[col] = df[col].astype(str).str.lower()
-                mask |= df[col].str.contains(query, na=False, regex=False)
+    def _build_search_index(self) -> Dict[str, tuple]:
+        index = {}
+        for col in _SEARCH_COLUMNS:
+            if col not in self.csv_data.columns:
+                continue
+            # arrow strings: lowercasing and substring search run as arrow kernels over one buffer
+            values = pa.array(self.csv_data[col].astype("string[pyarrow]").fillna("").str.lower())
+            postings = defaultdict(set)
+            for row, cell in enumerate(values.to_pylist()):
+                for token in _TOKEN_RE.findall(cell):
+                    postings[token].add(row)
+            index[col] = (values, postings)
+        return index
 
-        return df[mask]
+    def _search_products(self, query: str) -> pd.DataFrame:
+        query = query.lower()
+        # a token with non-word chars on both sides in the query must be a whole token in a matching cell
+        anchored = [m.group() for m in _TOKEN_RE.finditer(query) if m.start() > 0 and m.end() < len(query)]
+        if self._search_index is None:
+            self._search_index = self._build_search_index()
+        col_masks = np.zeros((len(self._search_index), len(self.csv_data)), dtype=bool)
+
+        for i, (values, postings) in enumerate(self._search_index.values()):
+            candidates = None
+            for token in anchored:
+                hits = postings.get(token, frozenset())
+                candidates = hits if candidates is None else candidates & hits
+
+            if candidates is None:
+                # scan the cached column in place, taking from it would copy every row
+                col_masks[i] = pc.match_substring(values, query).to_numpy(zero_copy_only=False)
+            elif candidates:
+                idx = np.fromiter(candidates, dtype=np.intp, count=len(candidates))
+                col_masks[i, idx] = pc.match_substring(values.take(idx), query).to_numpy(zero_copy_only=False)
+
+        return self.csv_data.iloc[col_masks.any(axis=0)]
 
     def _format_stock_results(self, products: List[Dict], query: str) -> str:
         if not products:
             return f"No products found for '{query}'"
 
-        result = f"Stock Information for '{query}':\n"
-        result += "=" * 50 + "\n\n"
+        parts = [f"Stock Information for '{query}':\n", _HEADER_RULE]
+        total_stock = 0
+        low_stock_count = 0
+        out_of_stock_count = 0
 
         for product in products:
-            result += f"Product: {product.get('name', 'N/A')}\n"
-            result += f"SKU: {product.get('sku', 'N/A')}\n"
-            result += f"Brand: {product.get('brand', 'N/A')}\n"
+            parts.append(f"Product: {product.get('name', 'N/A')}\n")
+            parts.append(f"SKU: {product.get('sku', 'N/A')}\n")
+            parts.append(f"Brand: {product.get('brand', 'N/A')}\n")
 
             quantity = product.get('quantity', 0)
             stock_status = product.get('stock_status', 'unknown')
             low_stock_threshold = product.get('low_stock_threshold', 10)
 
-            result += f"Current Stock: {quantity} units\n"
-            result += f"Stock Status: {stock_status}\n"
+            parts.append(f"Current Stock: {quantity} units\n")
+            parts.append(f"Stock Status: {stock_status}\n")
+            total_stock += quantity
+            low_stock_count += stock_status == 'low_stock'
+            out_of_stock_count += stock_status == 'out_of_stock'
 
             if low_stock_threshold:
-                result += f"Low Stock Threshold: {low_stock_threshold} units\n"
+                parts.append(f"Low Stock Threshold: {low_stock_threshold} units\n")
 
             price = product.get('price', 0)
             if price:
-                result += f"Price: ${float(price):.2f}\n"
+                parts.append(f"Price: ${float(price):.2f}\n")
 
             supplier_sku = product.get('supplier_sku', '')
             if supplier_sku:
-                result += f"Supplier SKU: {supplier_sku}\n"
+                parts.append(f"Supplier SKU: {supplier_sku}\n")
 
             lead_time = product.get('lead_time', '')
             if lead_time:
-                result += f"Lead Time: {lead_time} days\n"
+                parts.append(f"Lead Time: {lead_time} days\n")
 
             short_desc = product.get('short_description', '')
             if short_desc:
-                result += f"Description: {short_desc[:100]}...\n"
+                parts.append(f"Description: {short_desc[:100]}...\n")
 
-            result += "\n" + "-" * 30 + "\n\n"
+            parts.append(_PRODUCT_RULE)
 
         if len(products) > 1:
-            total_stock = sum(p.get('quantity', 0) for p in products)
-            low_stock_count = sum(1 for p in products if p.get('stock_status') == 'low_stock')
-            out_of_stock_count = sum(1 for p in products if p.get('stock_status') == 'out_of_stock')
-
-            result += f"SUMMARY:\n"
-            result += f"Total Products Found: {len(products)}\n"
-            result += f"Total Stock: {total_stock} units\n"
-            result += f"Low Stock Items: {low_stock_count}\n"
-            result += f"Out of Stock Items: {out_of_stock_count}\n"
+            parts.append(f"SUMMARY:\n")
+            parts.append(f"Total Products Found: {len(products)}\n")
+            parts.append(f"Total Stock: {total_stock} units\n")
+            parts.append(f"Low Stock Items: {low_stock_count}\n")
+            parts.append(f"Out of Stock Items: {out_of_stock_count}\n")
 
-        return result
\ No newline at end of file
+        return "".join(parts)
\ No newline at end of file